@@ -1,10 +1,13 @@
+import os
 from datetime import datetime
 from typing import Dict
 import pyarrow as pa
 
 class RsCutter:
-    def __init__(self, tables: Dict[str, pa.Table]) -> None: ...
+    def __init__(self, tables: Dict[str, pa.Table], pyramid: bool = False, pyramid_base_rows: int = 64) -> None: ...
     def total_row_count(self) -> int: ...
-    def slice(self, start: datetime | None = None, end: datetime | None = None, parralel: bool = False) -> Dict[str, pa.Table]:...
+    def slice(self, start: datetime | None = None, end: datetime | None = None, parralel: bool = False, skip_non_overlapping: bool = False, max_points: int | None = None) -> Dict[str, pa.Table]:...
+    def slice_to_ipc(self, start: datetime | None, end: datetime | None, sink: str | os.PathLike, compression: str | None = "zstd", skip_non_overlapping: bool = False) -> Dict[str, int]: ...
+    def slice_to_ipc_bytes(self, start: datetime | None, end: datetime | None, compression: str | None = "zstd", skip_non_overlapping: bool = False) -> Dict[str, bytes]: ...
 
 def to_uppercase(input: str) -> str: ...
@@ -8,4 +8,8 @@ pub enum MyError {
     ColumnTypeError(String),
     #[error("Date error: {0}")]
     DateError(String),
+    #[error("Argument error: {0}")]
+    ArgumentError(String),
+    #[error("Write error: {0}")]
+    WriteError(String),
 }
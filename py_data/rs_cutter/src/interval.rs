@@ -0,0 +1,84 @@
+/// Static interval tree over the `[first_ts, last_ts]` span of every table.
+///
+/// Spans are sorted by `first_ts` and laid out as an implicit balanced tree
+/// (the middle of a range is the root of that range). Each node stores the
+/// largest `last_ts` of its subtree so whole subtrees ending before the window
+/// can be pruned, which makes a query O(log T + k) for k overlapping tables.
+#[derive(Debug, Default)]
+pub struct IntervalIndex {
+    spans: Vec<(i64, i64, String)>,
+    max_last: Vec<i64>,
+}
+
+impl IntervalIndex {
+    pub fn new(mut spans: Vec<(i64, i64, String)>) -> Self {
+        spans.sort_by_key(|(first, _, _)| *first);
+
+        let mut index = IntervalIndex {
+            max_last: vec![i64::MIN; spans.len()],
+            spans,
+        };
+        index.build(0, index.spans.len());
+
+        index
+    }
+
+    /// Returns the keys of every span overlapping the half-open `[start, end)` window,
+    /// matching the slices which leave out rows stamped exactly at `end`.
+    /// A `None` end leaves the window unbounded on the right.
+    pub fn overlapping(&self, start: i64, end: Option<i64>) -> Vec<&str> {
+        let mut keys = vec![];
+        self.collect(0, self.spans.len(), start, end, &mut keys);
+        keys
+    }
+
+    fn build(&mut self, lo: usize, hi: usize) -> i64 {
+        if lo >= hi {
+            return i64::MIN;
+        }
+
+        let mid = (lo + hi) / 2;
+        let left_max = self.build(lo, mid);
+        let right_max = self.build(mid + 1, hi);
+
+        let max_last = self.spans[mid].1.max(left_max).max(right_max);
+        self.max_last[mid] = max_last;
+
+        max_last
+    }
+
+    fn collect<'a>(
+        &'a self,
+        lo: usize,
+        hi: usize,
+        start: i64,
+        end: Option<i64>,
+        keys: &mut Vec<&'a str>,
+    ) {
+        if lo >= hi {
+            return;
+        }
+
+        let mid = (lo + hi) / 2;
+
+        // Nothing in this subtree ends at or after the window start
+        if self.max_last[mid] < start {
+            return;
+        }
+
+        self.collect(lo, mid, start, end, keys);
+
+        let (first, last, key) = &self.spans[mid];
+
+        // Everything to the right starts even later than this span
+        if end.is_some_and(|end| *first >= end) {
+            return;
+        }
+
+        if *last >= start {
+            keys.push(key);
+        }
+
+        self.collect(mid + 1, hi, start, end, keys);
+    }
+}
@@ -1,20 +1,30 @@
-use std::collections::HashMap;
+use std::collections::{HashMap, HashSet};
+use std::fs::{self, File};
+use std::io::{BufWriter, Write};
+use std::path::{Component, Path, PathBuf};
 use std::sync::{Arc, Mutex};
 mod errors;
+mod interval;
+mod pyramid;
 use arrow::array::TimestampNanosecondArray;
-use arrow::datatypes::{ArrowTimestampType, TimestampNanosecondType};
+use arrow::datatypes::{ArrowTimestampType, SchemaRef, TimestampNanosecondType};
+use arrow::ipc::CompressionType;
+use arrow::ipc::writer::{FileWriter, IpcWriteOptions};
 use arrow::pyarrow::FromPyArrow;
+use arrow::record_batch::RecordBatchReader;
 use arrow::{array::RecordBatch, ffi_stream::ArrowArrayStreamReader};
 use chrono::NaiveDate;
 use errors::MyError;
+use interval::IntervalIndex;
 use pyo3::IntoPyObjectExt;
-use pyo3::exceptions::PyTypeError;
+use pyo3::exceptions::{PyIOError, PyTypeError, PyValueError};
 use pyo3::types::{PyDateAccess, PyDateTime, PyTimeAccess};
 use pyo3::{
     prelude::*,
-    types::{PyDict, PyString},
+    types::{PyBytes, PyDict, PyString},
 };
 use pyo3_arrow::PyTable;
+use pyramid::{PYRAMID_BASE_ROWS, Pyramid};
 use rayon::iter::{IntoParallelRefIterator, ParallelIterator};
 
 /// This function takes a Python string, converts it to uppercase, and returns it.
@@ -26,18 +36,36 @@ fn to_uppercase(input: String) -> PyResult<String> {
 #[pyclass]
 struct RsCutter {
     tables: HashMap<String, Vec<RecordBatch>>,
+    schemas: HashMap<String, SchemaRef>,
+    index: IntervalIndex,
+    unindexed: Vec<String>,
+    pyramids: HashMap<String, Pyramid>,
 }
 
 #[pymethods]
 impl RsCutter {
     #[new]
-    fn new(py: Python, tables: Py<PyDict>) -> PyResult<Self> {
+    #[pyo3(signature = (tables, pyramid=false, pyramid_base_rows=PYRAMID_BASE_ROWS))]
+    fn new(
+        py: Python,
+        tables: Py<PyDict>,
+        pyramid: bool,
+        pyramid_base_rows: usize,
+    ) -> PyResult<Self> {
+        if pyramid_base_rows == 0 {
+            return Err(PyErr::new::<PyValueError, _>(
+                "pyramid_base_rows must be at least 1",
+            ));
+        }
+
         let mut rs_tables = HashMap::new();
+        let mut rs_schemas = HashMap::new();
 
         for (key, val) in tables.into_bound(py).iter() {
             let key_str = key.downcast::<PyString>()?.to_str()?.to_owned();
 
             let mut reader = ArrowArrayStreamReader::from_pyarrow_bound(&val)?;
+            rs_schemas.insert(key_str.clone(), reader.schema());
 
             let mut table = vec![];
 
@@ -55,16 +83,59 @@ impl RsCutter {
             rs_tables.insert(key_str, table);
         }
 
-        Ok(RsCutter { tables: rs_tables })
+        let mut cutter = RsCutter {
+            tables: rs_tables,
+            schemas: rs_schemas,
+            index: IntervalIndex::default(),
+            unindexed: vec![],
+            pyramids: HashMap::new(),
+        };
+
+        let mut spans = vec![];
+        let mut unindexed = vec![];
+
+        for (key, table) in cutter.tables.iter() {
+            match cutter.get_span(table) {
+                Ok(Some((first_ts, last_ts))) => spans.push((first_ts, last_ts, key.clone())),
+                // Tables without rows never overlap a window and stay out of the index
+                Ok(None) => {}
+                // Spans can only be read from nanosecond TS columns, other tables
+                // are always sliced as if they overlapped the window
+                Err(_) => unindexed.push(key.clone()),
+            }
+        }
+
+        cutter.index = IntervalIndex::new(spans);
+        cutter.unindexed = unindexed;
+
+        if pyramid {
+            let pyramids = py.allow_threads(|| {
+                cutter
+                    .tables
+                    .par_iter()
+                    .map(|(key, table)| {
+                        Pyramid::build(&cutter.schemas[key], table, pyramid_base_rows)
+                            .map(|p| (key.clone(), p))
+                    })
+                    .collect::<Result<HashMap<String, Pyramid>, MyError>>()
+            });
+
+            cutter.pyramids =
+                pyramids.map_err(|e: MyError| PyErr::new::<PyTypeError, _>(format!("{e}")))?;
+        }
+
+        Ok(cutter)
     }
 
-    #[pyo3(signature = (start=None, end=None, parralel=false))]
+    #[pyo3(signature = (start=None, end=None, parralel=false, skip_non_overlapping=false, max_points=None))]
     fn slice(
         &self,
         py: Python,
         start: Option<Py<PyDateTime>>,
         end: Option<Py<PyDateTime>>,
         parralel: bool,
+        skip_non_overlapping: bool,
+        max_points: Option<usize>,
     ) -> PyResult<PyObject> {
         let start_ts = RsCutter::parse_py_timestamps(py, start)
             .map_err(|e: MyError| PyErr::new::<PyTypeError, _>(format!("{e}")))?;
@@ -74,19 +145,35 @@ impl RsCutter {
         // DROP GIL -- not really useful in my benchmark cause single threaded python program
         let sliced_tables = py.allow_threads(move || {
             let sliced_tables = Arc::new(Mutex::new(HashMap::new()));
+            // only tables whose [first_ts, last_ts] span overlaps the window get sliced
+            let overlapping = self.overlapping_tables(start_ts, end_ts);
             if parralel {
-                self.tables.par_iter().for_each(|(key, val)| {
-                    let sliced_rbs = self._slice(start_ts, end_ts, val);
+                overlapping.par_iter().for_each(|key| {
+                    let sliced_rbs = self._slice_table(key, start_ts, end_ts, max_points);
                     let mut sliced_tables_lock = sliced_tables.lock().unwrap();
-                    sliced_tables_lock.insert(key.clone(), sliced_rbs);
+                    sliced_tables_lock.insert(key.to_string(), sliced_rbs);
                 });
             } else {
-                for (key, value) in self.tables.iter() {
-                    let sliced_rbs = self._slice(start_ts, end_ts, value);
+                for key in overlapping.iter() {
+                    let sliced_rbs = self._slice_table(key, start_ts, end_ts, max_points);
                     sliced_tables
                         .lock()
                         .unwrap()
-                        .insert(key.clone(), sliced_rbs);
+                        .insert(key.to_string(), sliced_rbs);
+                }
+            }
+            if !skip_non_overlapping {
+                let mut sliced_tables_lock = sliced_tables.lock().unwrap();
+                for key in self.tables.keys() {
+                    sliced_tables_lock.entry(key.clone()).or_insert_with(|| {
+                        // downsampled slices share the aggregate schema, even when empty
+                        match max_points {
+                            Some(_) => Ok(vec![RecordBatch::new_empty(
+                                Pyramid::new(&self.schemas[key]).schema(),
+                            )]),
+                            None => Ok(vec![]),
+                        }
+                    });
                 }
             }
             sliced_tables
@@ -114,7 +201,11 @@ impl RsCutter {
             let py_value =
                 value.map_err(|e: MyError| PyErr::new::<PyTypeError, _>(format!("{e}")))?;
 
-            let schema = py_value.get(0).unwrap().schema();
+            // downsampled batches carry the aggregate schema
+            let schema = match py_value.first() {
+                Some(batch) => batch.schema(),
+                None => self.schemas[&key].clone(),
+            };
 
             let pa_table = PyTable::try_new(py_value, schema)?.to_pyarrow(py)?;
 
@@ -126,6 +217,102 @@ impl RsCutter {
         Ok(test)
     }
 
+    /// Slices every table and writes each one as an Arrow IPC file named
+    /// `<table name>.arrow` inside the `sink` directory. Slicing, compression and
+    /// writing happen in parallel across tables with the GIL released; only the
+    /// number of bytes written per table is returned to Python. Table names must
+    /// be plain file names, the call fails before writing anything otherwise.
+    /// Use `slice_to_ipc_bytes` to get in-memory buffers instead of files.
+    #[pyo3(signature = (start, end, sink, compression=Some("zstd".to_string()), skip_non_overlapping=false))]
+    fn slice_to_ipc(
+        &self,
+        py: Python,
+        start: Option<Py<PyDateTime>>,
+        end: Option<Py<PyDateTime>>,
+        sink: PathBuf,
+        compression: Option<String>,
+        skip_non_overlapping: bool,
+    ) -> PyResult<HashMap<String, u64>> {
+        let start_ts = RsCutter::parse_py_timestamps(py, start)
+            .map_err(|e: MyError| PyErr::new::<PyTypeError, _>(format!("{e}")))?;
+        let end_ts = RsCutter::parse_py_timestamps(py, end)
+            .map_err(|e: MyError| PyErr::new::<PyTypeError, _>(format!("{e}")))?;
+
+        let options =
+            RsCutter::parse_ipc_options(compression.as_deref()).map_err(RsCutter::ipc_py_err)?;
+
+        for key in self.tables.keys() {
+            RsCutter::check_file_name(key).map_err(RsCutter::ipc_py_err)?;
+        }
+
+        fs::create_dir_all(&sink)?;
+
+        let written = py.allow_threads(|| {
+            self._slice_each(start_ts, end_ts, skip_non_overlapping, |key, rbs| {
+                let path = sink.join(format!("{key}.arrow"));
+                let file = File::create(&path).map_err(|e| MyError::WriteError(e.to_string()))?;
+
+                // write_ipc finishes the IPC footer, flush pushes it to disk
+                RsCutter::write_ipc(
+                    BufWriter::new(file),
+                    self.schemas[key].clone(),
+                    rbs,
+                    &options,
+                )?
+                .flush()
+                .map_err(|e| MyError::WriteError(e.to_string()))?;
+
+                let metadata =
+                    fs::metadata(&path).map_err(|e| MyError::WriteError(e.to_string()))?;
+
+                Ok(metadata.len())
+            })
+        });
+
+        let mut byte_counts = HashMap::new();
+
+        for (key, res) in written.into_iter() {
+            byte_counts.insert(key, res.map_err(RsCutter::ipc_py_err)?);
+        }
+
+        Ok(byte_counts)
+    }
+
+    /// Same as `slice_to_ipc` but returns one in-memory IPC file per table as
+    /// `bytes`, ready to be sent as a response body without touching the disk.
+    #[pyo3(signature = (start, end, compression=Some("zstd".to_string()), skip_non_overlapping=false))]
+    fn slice_to_ipc_bytes(
+        &self,
+        py: Python,
+        start: Option<Py<PyDateTime>>,
+        end: Option<Py<PyDateTime>>,
+        compression: Option<String>,
+        skip_non_overlapping: bool,
+    ) -> PyResult<PyObject> {
+        let start_ts = RsCutter::parse_py_timestamps(py, start)
+            .map_err(|e: MyError| PyErr::new::<PyTypeError, _>(format!("{e}")))?;
+        let end_ts = RsCutter::parse_py_timestamps(py, end)
+            .map_err(|e: MyError| PyErr::new::<PyTypeError, _>(format!("{e}")))?;
+
+        let options =
+            RsCutter::parse_ipc_options(compression.as_deref()).map_err(RsCutter::ipc_py_err)?;
+
+        let written = py.allow_threads(|| {
+            self._slice_each(start_ts, end_ts, skip_non_overlapping, |key, rbs| {
+                RsCutter::write_ipc(Vec::<u8>::new(), self.schemas[key].clone(), rbs, &options)
+            })
+        });
+
+        let py_buffers = PyDict::new(py);
+
+        for (key, res) in written.into_iter() {
+            let buffer = res.map_err(RsCutter::ipc_py_err)?;
+            py_buffers.set_item(key, PyBytes::new(py, &buffer))?;
+        }
+
+        py_buffers.into_py_any(py)
+    }
+
     fn total_row_count(&self) -> usize {
         self.tables
             .values()
@@ -136,6 +323,44 @@ impl RsCutter {
 }
 
 impl RsCutter {
+    /// Slices one table. With `max_points` the window is downsampled to at least
+    /// that many buckets, from the table's pyramid when one was built or on the
+    /// fly from the raw rows otherwise, and always uses the aggregate schema.
+    fn _slice_table(
+        &self,
+        key: &str,
+        start: Option<i64>,
+        end: Option<i64>,
+        max_points: Option<usize>,
+    ) -> Result<Vec<RecordBatch>, MyError> {
+        let rbs = &self.tables[key];
+
+        if let Some(max_points) = max_points {
+            let length = RsCutter::get_length(rbs);
+
+            let start_row = match start {
+                Some(s) => self.binary_search_ts(rbs, s, length)?,
+                None => 0,
+            };
+
+            let end_row = match end {
+                Some(e) => self.binary_search_ts(rbs, e, length)?,
+                None => length,
+            };
+
+            let batch = match self.pyramids.get(key) {
+                Some(pyramid) => pyramid.select(rbs, start_row, end_row, max_points)?,
+                None => {
+                    Pyramid::new(&self.schemas[key]).select(rbs, start_row, end_row, max_points)?
+                }
+            };
+
+            return Ok(vec![batch]);
+        }
+
+        self._slice(start, end, rbs)
+    }
+
     fn _slice(
         &self,
         start: Option<i64>,
@@ -251,6 +476,65 @@ impl RsCutter {
         return Err(MyError::IndexError(format!("Index {index} out of bounds")));
     }
 
+    /// Returns the first and last timestamps of a table, or None if it has no rows.
+    fn get_span(&self, batches: &[RecordBatch]) -> Result<Option<(i64, i64)>, MyError> {
+        let length = RsCutter::get_length(batches);
+
+        if length == 0 {
+            return Ok(None);
+        }
+
+        Ok(Some((
+            self.get_ts(batches, 0)?,
+            self.get_ts(batches, length - 1)?,
+        )))
+    }
+
+    fn overlapping_tables(&self, start: Option<i64>, end: Option<i64>) -> Vec<&str> {
+        if let (Some(start_val), Some(end_val)) = (start, end) {
+            if start_val > end_val {
+                return vec![];
+            }
+        }
+
+        let mut keys = self.index.overlapping(start.unwrap_or(i64::MIN), end);
+        keys.extend(self.unindexed.iter().map(String::as_str));
+
+        keys
+    }
+
+    /// Slices the tables an IPC export covers, in parallel, and applies `write` to each one.
+    fn _slice_each<T: Send>(
+        &self,
+        start: Option<i64>,
+        end: Option<i64>,
+        skip_non_overlapping: bool,
+        write: impl Fn(&str, &[RecordBatch]) -> Result<T, MyError> + Sync,
+    ) -> Vec<(String, Result<T, MyError>)> {
+        let overlapping = self.overlapping_tables(start, end);
+
+        let keys: Vec<&str> = if skip_non_overlapping {
+            overlapping.clone()
+        } else {
+            self.tables.keys().map(String::as_str).collect()
+        };
+        let overlapping: HashSet<&str> = overlapping.into_iter().collect();
+
+        keys.par_iter()
+            .map(|key| {
+                let sliced_rbs = if overlapping.contains(key) {
+                    self._slice(start, end, &self.tables[*key])
+                } else {
+                    Ok(vec![])
+                };
+                (
+                    key.to_string(),
+                    sliced_rbs.and_then(|rbs| write(*key, rbs.as_slice())),
+                )
+            })
+            .collect()
+    }
+
     fn get_length(batches: &[RecordBatch]) -> usize {
         batches.iter().map(|b| b.num_rows()).sum()
     }
@@ -261,10 +545,12 @@ impl RsCutter {
         target_ts: i64,
         total_rows: usize,
     ) -> Result<usize, MyError> {
+        // Half-open [start_index, end_index) so a target before the first row
+        // cannot underflow end_index
         let mut start_index = 0;
-        let mut end_index = total_rows - 1;
+        let mut end_index = total_rows;
 
-        while start_index <= end_index {
+        while start_index < end_index {
             let mid_index = (start_index + end_index) / 2;
 
             // Get the timestamp at mid_index across all batches using get_ts
@@ -273,16 +559,74 @@ impl RsCutter {
             // Compare the timestamp to the target
             if ts < target_ts {
                 start_index = mid_index + 1;
-            } else if ts > target_ts {
-                end_index = mid_index - 1;
             } else {
-                return Ok(mid_index);
+                end_index = mid_index;
             }
         }
-        // Return the index where the timestamp should be inserted or found
+        // Return the index of the first timestamp at or after the target
         Ok(start_index)
     }
 
+    fn parse_ipc_options(compression: Option<&str>) -> Result<IpcWriteOptions, MyError> {
+        let compression_type = match compression {
+            None => None,
+            Some("zstd") => Some(CompressionType::ZSTD),
+            Some("lz4") => Some(CompressionType::LZ4_FRAME),
+            Some(other) => {
+                return Err(MyError::ArgumentError(format!(
+                    "Unsupported IPC compression '{other}', expected 'zstd', 'lz4' or None"
+                )));
+            }
+        };
+
+        IpcWriteOptions::default()
+            .try_with_compression(compression_type)
+            .map_err(|e| MyError::ArgumentError(e.to_string()))
+    }
+
+    /// Writes a complete IPC file (schema, batches and footer) to `writer` and hands it back.
+    fn write_ipc<W: Write>(
+        writer: W,
+        schema: SchemaRef,
+        rbs: &[RecordBatch],
+        options: &IpcWriteOptions,
+    ) -> Result<W, MyError> {
+        let mut writer = FileWriter::try_new_with_options(writer, &schema, options.clone())
+            .map_err(|e| MyError::WriteError(e.to_string()))?;
+
+        for batch in rbs {
+            writer
+                .write(batch)
+                .map_err(|e| MyError::WriteError(e.to_string()))?;
+        }
+
+        writer
+            .into_inner()
+            .map_err(|e| MyError::WriteError(e.to_string()))
+    }
+
+    /// Table names end up in file names, so they cannot point anywhere else.
+    fn check_file_name(key: &str) -> Result<(), MyError> {
+        let mut components = Path::new(key).components();
+
+        match (components.next(), components.next()) {
+            (Some(Component::Normal(name)), None) if name == key && !key.contains(['/', '\\']) => {
+                Ok(())
+            }
+            _ => Err(MyError::ArgumentError(format!(
+                "Table name '{key}' cannot be used as a file name"
+            ))),
+        }
+    }
+
+    fn ipc_py_err(e: MyError) -> PyErr {
+        match e {
+            MyError::ArgumentError(_) => PyErr::new::<PyValueError, _>(format!("{e}")),
+            MyError::WriteError(_) => PyErr::new::<PyIOError, _>(format!("{e}")),
+            _ => PyErr::new::<PyTypeError, _>(format!("{e}")),
+        }
+    }
+
     fn parse_py_timestamps(py: Python, ts: Option<Py<PyDateTime>>) -> Result<Option<i64>, MyError> {
         if ts.is_none() {
             return Ok(None);
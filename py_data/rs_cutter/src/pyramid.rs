@@ -0,0 +1,428 @@
+use std::ops::Range;
+use std::sync::Arc;
+
+use arrow::array::{Array, ArrayRef, Float64Array, RecordBatch, TimestampNanosecondArray};
+use arrow::compute::cast;
+use arrow::datatypes::{DataType, Field, Schema, SchemaRef};
+
+use crate::errors::MyError;
+
+/// Number of buckets of one level folded into a single bucket of the next level.
+pub const PYRAMID_FACTOR: usize = 8;
+
+/// Default number of raw rows per bucket of the finest level. Aggregates take
+/// roughly `4 / base * 8 / 7` of the raw numeric data, about 7% at 64.
+pub const PYRAMID_BASE_ROWS: usize = 64;
+
+/// min/max/first/last of every bucket of one column, nulls are stored as NaN.
+struct Aggregates {
+    min: Vec<f64>,
+    max: Vec<f64>,
+    first: Vec<f64>,
+    last: Vec<f64>,
+}
+
+impl Aggregates {
+    fn new() -> Self {
+        Aggregates {
+            min: vec![],
+            max: vec![],
+            first: vec![],
+            last: vec![],
+        }
+    }
+
+    /// Starts a new bucket with its first value.
+    fn push(&mut self, value: f64) {
+        self.min.push(value);
+        self.max.push(value);
+        self.first.push(value);
+        self.last.push(value);
+    }
+
+    /// Folds another value into the last bucket.
+    fn update(&mut self, value: f64) {
+        if let (Some(min), Some(max), Some(last)) = (
+            self.min.last_mut(),
+            self.max.last_mut(),
+            self.last.last_mut(),
+        ) {
+            *min = min.min(value);
+            *max = max.max(value);
+            *last = value;
+        }
+    }
+
+    fn pop(&mut self) {
+        self.min.pop();
+        self.max.pop();
+        self.first.pop();
+        self.last.pop();
+    }
+
+    fn downsample(&self, factor: usize) -> Self {
+        Aggregates {
+            min: self
+                .min
+                .chunks_exact(factor)
+                .map(|b| b.iter().fold(f64::NAN, |acc, v| acc.min(*v)))
+                .collect(),
+            max: self
+                .max
+                .chunks_exact(factor)
+                .map(|b| b.iter().fold(f64::NAN, |acc, v| acc.max(*v)))
+                .collect(),
+            first: self.first.chunks_exact(factor).map(|b| b[0]).collect(),
+            last: self
+                .last
+                .chunks_exact(factor)
+                .map(|b| b[b.len() - 1])
+                .collect(),
+        }
+    }
+
+    fn extend_from(&mut self, other: &Aggregates, range: Range<usize>) {
+        self.min.extend_from_slice(&other.min[range.clone()]);
+        self.max.extend_from_slice(&other.max[range.clone()]);
+        self.first.extend_from_slice(&other.first[range.clone()]);
+        self.last.extend_from_slice(&other.last[range]);
+    }
+}
+
+/// A run of buckets, each stamped with the timestamps of its first and last row.
+struct Buckets {
+    ts_first: Vec<i64>,
+    ts_last: Vec<i64>,
+    columns: Vec<Aggregates>,
+}
+
+impl Buckets {
+    fn new(num_columns: usize) -> Self {
+        Buckets {
+            ts_first: vec![],
+            ts_last: vec![],
+            columns: (0..num_columns).map(|_| Aggregates::new()).collect(),
+        }
+    }
+
+    fn pop(&mut self) {
+        self.ts_first.pop();
+        self.ts_last.pop();
+
+        for aggs in self.columns.iter_mut() {
+            aggs.pop();
+        }
+    }
+
+    fn downsample(&self, factor: usize) -> Self {
+        Buckets {
+            ts_first: self.ts_first.chunks_exact(factor).map(|b| b[0]).collect(),
+            ts_last: self
+                .ts_last
+                .chunks_exact(factor)
+                .map(|b| b[b.len() - 1])
+                .collect(),
+            columns: self
+                .columns
+                .iter()
+                .map(|aggs| aggs.downsample(factor))
+                .collect(),
+        }
+    }
+
+    fn extend_from(&mut self, other: &Buckets, range: Range<usize>) {
+        self.ts_first
+            .extend_from_slice(&other.ts_first[range.clone()]);
+        self.ts_last
+            .extend_from_slice(&other.ts_last[range.clone()]);
+
+        for (aggs, other_aggs) in self.columns.iter_mut().zip(other.columns.iter()) {
+            aggs.extend_from(other_aggs, range.clone());
+        }
+    }
+
+    fn into_batch(self, schema: SchemaRef) -> Result<RecordBatch, MyError> {
+        let ts_type = schema.field(0).data_type().clone();
+
+        let mut columns: Vec<ArrayRef> = vec![
+            Arc::new(TimestampNanosecondArray::from(self.ts_first).with_data_type(ts_type.clone())),
+            Arc::new(TimestampNanosecondArray::from(self.ts_last).with_data_type(ts_type)),
+        ];
+
+        for aggs in self.columns {
+            for values in [aggs.min, aggs.max, aggs.first, aggs.last] {
+                columns.push(Arc::new(Float64Array::from(values)));
+            }
+        }
+
+        RecordBatch::try_new(schema, columns).map_err(|e| MyError::ColumnTypeError(e.to_string()))
+    }
+}
+
+/// One resolution of the pyramid, bucket `i` covers raw rows
+/// `[i * bucket_rows, (i + 1) * bucket_rows)`.
+struct Level {
+    bucket_rows: usize,
+    buckets: Buckets,
+}
+
+/// Precomputed min/max/first/last downsampling of a table at resolutions of
+/// `base`, `base * PYRAMID_FACTOR`, `base * PYRAMID_FACTOR^2`, ... rows per bucket.
+///
+/// Downsampled slices always use the aggregate schema: `TS`, `TS_last`, then
+/// `<col>_min`, `<col>_max`, `<col>_first`, `<col>_last` as Float64 for every
+/// numeric column. Non-numeric columns are dropped.
+pub struct Pyramid {
+    schema: SchemaRef,
+    columns: Vec<usize>,
+    levels: Vec<Level>,
+}
+
+impl Pyramid {
+    /// A pyramid without levels, windows are downsampled from the raw rows on the fly.
+    pub fn new(schema: &SchemaRef) -> Self {
+        let ts_field = schema.field(0);
+
+        let mut fields = vec![
+            ts_field.clone(),
+            Field::new(
+                format!("{}_last", ts_field.name()),
+                ts_field.data_type().clone(),
+                ts_field.is_nullable(),
+            ),
+        ];
+        let mut columns = vec![];
+
+        // Only numeric columns can be aggregated, everything else is dropped
+        for (i, field) in schema.fields().iter().enumerate().skip(1) {
+            if !field.data_type().is_numeric() {
+                continue;
+            }
+
+            for agg in ["min", "max", "first", "last"] {
+                fields.push(Field::new(
+                    format!("{}_{agg}", field.name()),
+                    DataType::Float64,
+                    true,
+                ));
+            }
+            columns.push(i);
+        }
+
+        Pyramid {
+            schema: Arc::new(Schema::new(fields)),
+            columns,
+            levels: vec![],
+        }
+    }
+
+    /// Builds the levels of a table. Only the finest level reads the raw rows,
+    /// one record batch at a time, every coarser level folds the previous one.
+    pub fn build(
+        schema: &SchemaRef,
+        rbs: &[RecordBatch],
+        base_rows: usize,
+    ) -> Result<Self, MyError> {
+        let mut pyramid = Pyramid::new(schema);
+
+        let length: usize = rbs.iter().map(|b| b.num_rows()).sum();
+        let mut bucket_rows = base_rows;
+
+        while length / bucket_rows > 0 {
+            let buckets = match pyramid.levels.last() {
+                None => {
+                    let mut buckets = Buckets::new(pyramid.columns.len());
+                    pyramid.aggregate_rows(rbs, 0, length, bucket_rows, false, &mut buckets)?;
+                    buckets
+                }
+                Some(prev) => prev.buckets.downsample(PYRAMID_FACTOR),
+            };
+
+            pyramid.levels.push(Level {
+                bucket_rows,
+                buckets,
+            });
+            bucket_rows *= PYRAMID_FACTOR;
+        }
+
+        Ok(pyramid)
+    }
+
+    pub fn schema(&self) -> SchemaRef {
+        self.schema.clone()
+    }
+
+    /// Downsamples the raw row range `[start_row, end_row)` of `rbs` to at least
+    /// `max_points` buckets.
+    ///
+    /// Uses the coarsest level giving at least `max_points` buckets, counting the
+    /// partial buckets at both edges which are aggregated from the raw rows so no
+    /// row of the range is left out. Without such a level the range is bucketed on
+    /// the fly from the raw rows, and a range with fewer than `max_points` rows
+    /// returns every row as its own bucket with min = max = first = last = value.
+    pub fn select(
+        &self,
+        rbs: &[RecordBatch],
+        start_row: usize,
+        end_row: usize,
+        max_points: usize,
+    ) -> Result<RecordBatch, MyError> {
+        let mut buckets = Buckets::new(self.columns.len());
+        let rows = end_row.saturating_sub(start_row);
+
+        if rows == 0 {
+            return buckets.into_batch(self.schema.clone());
+        }
+
+        let level = self.levels.iter().rev().find(|level| {
+            Pyramid::bucket_count(level.bucket_rows, start_row, end_row) >= max_points
+        });
+
+        match level {
+            Some(level) => {
+                let first_bucket = start_row.div_ceil(level.bucket_rows);
+                let end_bucket = end_row / level.bucket_rows;
+
+                if end_bucket < first_bucket {
+                    // The whole range sits inside a single bucket of this level
+                    self.aggregate_rows(rbs, start_row, end_row, rows, true, &mut buckets)?;
+                } else {
+                    let head_end = first_bucket * level.bucket_rows;
+                    let tail_start = end_bucket * level.bucket_rows;
+
+                    self.aggregate_rows(
+                        rbs,
+                        start_row,
+                        head_end,
+                        level.bucket_rows,
+                        true,
+                        &mut buckets,
+                    )?;
+                    buckets.extend_from(&level.buckets, first_bucket..end_bucket);
+                    self.aggregate_rows(
+                        rbs,
+                        tail_start,
+                        end_row,
+                        level.bucket_rows,
+                        true,
+                        &mut buckets,
+                    )?;
+                }
+            }
+            None if max_points > 0 && rows >= max_points => {
+                // Between max_points and 2 * max_points buckets
+                let bucket_rows = rows / max_points;
+                self.aggregate_rows(rbs, start_row, end_row, bucket_rows, true, &mut buckets)?;
+            }
+            None => self.aggregate_rows(rbs, start_row, end_row, 1, true, &mut buckets)?,
+        }
+
+        buckets.into_batch(self.schema.clone())
+    }
+
+    /// Number of buckets a level returns for a non-empty range, edges included.
+    fn bucket_count(bucket_rows: usize, start_row: usize, end_row: usize) -> usize {
+        let first_bucket = start_row.div_ceil(bucket_rows);
+        let end_bucket = end_row / bucket_rows;
+
+        if end_bucket < first_bucket {
+            return 1;
+        }
+
+        let head = (first_bucket * bucket_rows > start_row) as usize;
+        let tail = (end_row > end_bucket * bucket_rows) as usize;
+
+        end_bucket - first_bucket + head + tail
+    }
+
+    /// Aggregates the raw rows `[start_row, end_row)` into buckets of `bucket_rows`
+    /// rows appended to `buckets`, reading one record batch at a time. A trailing
+    /// partial bucket is only kept with `keep_partial`.
+    fn aggregate_rows(
+        &self,
+        rbs: &[RecordBatch],
+        start_row: usize,
+        end_row: usize,
+        bucket_rows: usize,
+        keep_partial: bool,
+        buckets: &mut Buckets,
+    ) -> Result<(), MyError> {
+        let mut filled = 0;
+        let mut cum_start_index = 0;
+
+        for batch in rbs {
+            let batch_offset = cum_start_index;
+            cum_start_index += batch.num_rows();
+
+            let batch_start = start_row.max(batch_offset);
+            let batch_end = end_row.min(cum_start_index);
+
+            if batch_start >= batch_end {
+                continue;
+            }
+
+            let batch = batch.slice(batch_start - batch_offset, batch_end - batch_start);
+
+            let ts_array = batch
+                .column(0)
+                .as_any()
+                .downcast_ref::<TimestampNanosecondArray>()
+                .ok_or(MyError::ColumnTypeError(
+                    "TS column is not a TimestampNanosecondArray".to_string(),
+                ))?;
+
+            let mut float_arrays = vec![];
+
+            for i in self.columns.iter() {
+                let float_array = cast(batch.column(*i), &DataType::Float64)
+                    .map_err(|e| MyError::ColumnTypeError(e.to_string()))?;
+                float_arrays.push(float_array);
+            }
+
+            let float_arrays = float_arrays
+                .iter()
+                .map(|array| {
+                    array
+                        .as_any()
+                        .downcast_ref::<Float64Array>()
+                        .ok_or(MyError::ColumnTypeError(
+                            "Column could not be cast to Float64".to_string(),
+                        ))
+                })
+                .collect::<Result<Vec<&Float64Array>, MyError>>()?;
+
+            for row in 0..batch.num_rows() {
+                let ts = ts_array.value(row);
+
+                if filled == 0 {
+                    buckets.ts_first.push(ts);
+                    buckets.ts_last.push(ts);
+                } else if let Some(ts_last) = buckets.ts_last.last_mut() {
+                    *ts_last = ts;
+                }
+
+                for (aggs, array) in buckets.columns.iter_mut().zip(float_arrays.iter()) {
+                    let value = if array.is_null(row) {
+                        f64::NAN
+                    } else {
+                        array.value(row)
+                    };
+
+                    if filled == 0 {
+                        aggs.push(value);
+                    } else {
+                        aggs.update(value);
+                    }
+                }
+
+                filled = (filled + 1) % bucket_rows;
+            }
+        }
+
+        if !keep_partial && filled > 0 {
+            buckets.pop();
+        }
+
+        Ok(())
+    }
+}
@@ -1,6 +1,7 @@
 from py_data.tablify import create_single_table
 from rs_cutter import RsCutter
 import pandas as pd
+import pyarrow as pa
 import pytest
 from datetime import datetime
 from py_data.tablify import create_random_tables
@@ -102,4 +103,230 @@ def test_rs_cutter_init():
 
     cutter = RsCutter(table)
 
-    assert cutter.total_row_count() == 100
\ No newline at end of file
+    assert cutter.total_row_count() == 100
+
+# Test that slice_to_ipc writes one readable IPC file per table with the sliced rows
+def test_slice_to_ipc(cutter, tmp_path):
+    start_date = datetime(2023, 1, 3)
+    end_date = datetime(2023, 1, 7)
+
+    byte_counts = cutter.slice_to_ipc(start_date, end_date, str(tmp_path))
+    sliced_tables = cutter.slice(start=start_date, end=end_date)
+
+    assert byte_counts.keys() == sliced_tables.keys()
+
+    for table_name, n_bytes in byte_counts.items():
+        path = tmp_path / f"{table_name}.arrow"
+        assert path.stat().st_size == n_bytes
+
+        written = pa.ipc.open_file(path).read_all()
+        assert written.equals(sliced_tables[table_name])
+
+# Test that slice_to_ipc can write uncompressed files and rejects unknown codecs
+def test_slice_to_ipc_compression(cutter, tmp_path):
+    byte_counts = cutter.slice_to_ipc(None, None, str(tmp_path), compression=None)
+
+    for table_name in byte_counts:
+        written = pa.ipc.open_file(tmp_path / f"{table_name}.arrow").read_all()
+        assert written.num_rows > 0
+
+    with pytest.raises(ValueError):
+        cutter.slice_to_ipc(None, None, str(tmp_path), compression="gzip")
+
+# Test that slice_to_ipc_bytes returns in-memory IPC files matching the sliced tables
+def test_slice_to_ipc_bytes(cutter):
+    start_date = datetime(2023, 1, 3)
+    end_date = datetime(2023, 1, 7)
+
+    buffers = cutter.slice_to_ipc_bytes(start_date, end_date)
+    sliced_tables = cutter.slice(start=start_date, end=end_date)
+
+    assert buffers.keys() == sliced_tables.keys()
+
+    for table_name, buffer in buffers.items():
+        assert isinstance(buffer, bytes)
+        written = pa.ipc.open_file(pa.BufferReader(buffer)).read_all()
+        assert written.equals(sliced_tables[table_name])
+
+    with pytest.raises(ValueError):
+        cutter.slice_to_ipc_bytes(None, None, compression="gzip")
+
+# Test that table names which are not plain file names are rejected before anything is written
+@pytest.mark.parametrize("bad_name", ["../escaped", "nested/table", "/tmp/absolute", "..", ""])
+def test_slice_to_ipc_rejects_unsafe_names(tmp_path, bad_name):
+    tables = {
+        **create_single_table(10, 2, table_name="Safe"),
+        **create_single_table(10, 2, table_name=bad_name),
+    }
+    cutter = RsCutter(tables)
+    sink = tmp_path / "sink"
+
+    with pytest.raises(ValueError):
+        cutter.slice_to_ipc(None, None, str(sink))
+
+    assert not sink.exists()
+    assert list(tmp_path.iterdir()) == []
+
+# Test that tables whose time span misses the window come back empty or are skipped
+def test_slice_skip_non_overlapping():
+    tables = {
+        **create_single_table(100, 3, start=datetime(2020, 1, 1), table_name="Early"),
+        **create_single_table(100, 3, start=datetime(2021, 1, 1), table_name="Late"),
+        **create_single_table(0, 3, table_name="Empty"),
+    }
+    cutter = RsCutter(tables)
+
+    start_date = datetime(2021, 1, 1)
+    end_date = datetime(2021, 1, 2)
+
+    sliced_tables = cutter.slice(start=start_date, end=end_date)
+    assert sliced_tables.keys() == tables.keys()
+    assert sliced_tables["Early"].num_rows == 0
+    assert sliced_tables["Empty"].num_rows == 0
+    assert sliced_tables["Early"].schema.equals(tables["Early"].schema, check_metadata=False)
+
+    skipped_tables = cutter.slice(start=start_date, end=end_date, skip_non_overlapping=True)
+    assert list(skipped_tables.keys()) == ["Late"]
+    assert skipped_tables["Late"].equals(sliced_tables["Late"])
+
+AGGREGATE_COLUMNS = [
+    "TS", "TS_last",
+    "Column 1_min", "Column 1_max", "Column 1_first", "Column 1_last",
+    "Column 2_min", "Column 2_max", "Column 2_first", "Column 2_last",
+]
+
+# Test that a wide window with max_points is answered from the pyramid at screen resolution
+def test_slice_max_points():
+    tables = create_single_table(100_000, 2)
+    cutter = RsCutter(tables, pyramid=True)
+
+    start_date = datetime(2020, 1, 2)
+    end_date = datetime(2020, 2, 1)
+
+    raw = cutter.slice(start=start_date, end=end_date)["Table 1"]
+    downsampled = cutter.slice(start=start_date, end=end_date, max_points=500)["Table 1"]
+
+    assert 500 <= downsampled.num_rows < raw.num_rows
+    assert downsampled.column_names == AGGREGATE_COLUMNS
+
+# Test that the downsampled window covers every raw row, including the partial buckets at both edges
+@pytest.mark.parametrize("start_date, end_date", [
+    (None, None),
+    (datetime(2020, 1, 2, 0, 3), datetime(2020, 2, 1, 7, 11)),
+])
+def test_slice_max_points_covers_edges(start_date, end_date):
+    tables = create_single_table(100_000, 2)
+    cutter = RsCutter(tables, pyramid=True)
+
+    raw_df = cutter.slice(start=start_date, end=end_date)["Table 1"].to_pandas()
+    df = cutter.slice(start=start_date, end=end_date, max_points=10)["Table 1"].to_pandas()
+
+    assert 10 <= len(df) < len(raw_df)
+    assert df['TS'].iloc[0] == raw_df['TS'].iloc[0]
+    assert df['TS_last'].iloc[-1] == raw_df['TS'].iloc[-1]
+    assert df['Column 1_first'].iloc[0] == raw_df['Column 1'].iloc[0]
+    assert df['Column 1_last'].iloc[-1] == raw_df['Column 1'].iloc[-1]
+
+    for column in ["Column 1", "Column 2"]:
+        assert df[f'{column}_min'].min() == raw_df[column].min()
+        assert df[f'{column}_max'].max() == raw_df[column].max()
+
+# Test that narrow windows return every raw row with the aggregate schema
+def test_slice_max_points_raw_windows():
+    tables = {
+        **create_single_table(100_000, 2),
+        **create_single_table(100, 2, start=datetime(2021, 1, 1), table_name="Table 2"),
+    }
+    cutter = RsCutter(tables, pyramid=True)
+
+    start_date = datetime(2020, 1, 3)
+    end_date = datetime(2020, 1, 3, 1)
+
+    raw = cutter.slice(start=start_date, end=end_date)["Table 1"].to_pandas()
+    wide = cutter.slice(max_points=10)
+    narrow = cutter.slice(start=start_date, end=end_date, max_points=1_000_000)
+
+    for result in [wide, narrow]:
+        for table in result.values():
+            assert table.column_names == AGGREGATE_COLUMNS
+
+    # Table 2 does not overlap the window but still comes back with the aggregate schema
+    assert narrow["Table 2"].num_rows == 0
+
+    df = narrow["Table 1"].to_pandas()
+    assert len(df) == len(raw)
+    assert (df['TS'] == raw['TS']).all()
+    assert (df['TS_last'] == raw['TS']).all()
+    for agg in ["min", "max", "first", "last"]:
+        assert (df[f'Column 1_{agg}'] == raw['Column 1']).all()
+
+# Test that a cutter without a pyramid still downsamples to max_points on the fly
+def test_slice_max_points_without_pyramid():
+    tables = create_single_table(100_000, 2)
+    cutter = RsCutter(tables)
+
+    start_date = datetime(2020, 1, 2, 0, 3)
+    end_date = datetime(2020, 2, 1, 7, 11)
+
+    raw_df = cutter.slice(start=start_date, end=end_date)["Table 1"].to_pandas()
+    downsampled = cutter.slice(start=start_date, end=end_date, max_points=500)["Table 1"]
+    df = downsampled.to_pandas()
+
+    assert downsampled.column_names == AGGREGATE_COLUMNS
+    assert 500 <= len(df) < 1000
+    assert df['TS'].iloc[0] == raw_df['TS'].iloc[0]
+    assert df['TS_last'].iloc[-1] == raw_df['TS'].iloc[-1]
+    assert df['Column 1_min'].min() == raw_df['Column 1'].min()
+    assert df['Column 1_max'].max() == raw_df['Column 1'].max()
+
+# Test that the partial edge buckets count towards max_points when picking a level
+def test_slice_max_points_counts_edge_buckets():
+    tables = create_single_table(10_000, 2)
+    cutter = RsCutter(tables, pyramid=True, pyramid_base_rows=8)
+
+    # rows [4, 8003): 999 full 8-row buckets plus a partial bucket at each edge
+    start_date = datetime(2020, 1, 1, 0, 4)
+    end_date = datetime(2020, 1, 6, 13, 23)
+
+    raw = cutter.slice(start=start_date, end=end_date)["Table 1"]
+    downsampled = cutter.slice(start=start_date, end=end_date, max_points=1000)["Table 1"]
+
+    assert raw.num_rows == 7999
+    assert downsampled.num_rows == 1001
+
+# Test that the finest pyramid level must hold at least one row per bucket
+def test_pyramid_base_rows_must_be_positive(tables):
+    with pytest.raises(ValueError):
+        RsCutter(tables, pyramid=True, pyramid_base_rows=0)
+
+# Test that a table starting exactly at the (exclusive) end of the window does not overlap it
+def test_slice_skip_non_overlapping_end_boundary():
+    tables = {
+        **create_single_table(100, 3, start=datetime(2020, 1, 1), table_name="Before"),
+        **create_single_table(100, 3, start=datetime(2020, 1, 1, 2), table_name="Boundary"),
+    }
+    cutter = RsCutter(tables)
+
+    start_date = datetime(2019, 12, 31)
+    end_date = datetime(2020, 1, 1, 2)
+
+    sliced_tables = cutter.slice(start=start_date, end=end_date)
+    assert sliced_tables["Before"].num_rows == 100
+    assert sliced_tables["Boundary"].num_rows == 0
+
+    skipped_tables = cutter.slice(start=start_date, end=end_date, skip_non_overlapping=True)
+    assert list(skipped_tables.keys()) == ["Before"]
+
+# Test that tables with a non-nanosecond TS column still load and are always treated as overlapping
+def test_non_nanosecond_table_stays_out_of_index():
+    tables = create_single_table(100, 2)
+    micro_table = tables["Table 1"]
+    micro_table = micro_table.set_column(0, "TS", micro_table.column("TS").cast(pa.timestamp("us")))
+    tables["Micro"] = micro_table
+
+    cutter = RsCutter(tables)
+    assert cutter.total_row_count() == 200
+
+    sliced_tables = cutter.slice(skip_non_overlapping=True)
+    assert sliced_tables.keys() == tables.keys()
+    assert sliced_tables["Micro"].equals(micro_table)